@@ -7,8 +7,8 @@ import sys
 from typing import Tuple, List, Optional, Union
 from colorama import Fore, Style
 from includes import (
-    list_regions, list_os, find_ec2, get_ec2_spot_price,
-    get_ec2_spot_interruption, print_help, region_map,
+    list_regions, list_os, find_ec2, rank_ec2, get_ec2_spot_price,
+    get_ec2_spot_advice, print_help, region_map,
     P_VCPU, P_RAM, P_OS, P_REGION, REGION_NVIRGINIA
 )
 
@@ -19,8 +19,8 @@ DAYS_PER_MONTH = 30
 MONTHLY_HOURS = HOURS_PER_DAY * DAYS_PER_MONTH
 
 # Output format templates
-HEADER_FORMAT = "{:<15} {:<6} {:<6} {:<10} {:<8} {:<11} {:<8} {:<10} {:<8}"
-INSTANCE_FORMAT = "{:<15} {:<6.2f} {:<6.2f} {:<10} {:.5f}  {:<10.5f}  {:.5f}  {:<10.5f} {:<3}"
+HEADER_FORMAT = "{:<15} {:<6} {:<6} {:<10} {:<8} {:<11} {:<8} {:<10} {:<8} {:<7}"
+INSTANCE_FORMAT = "{:<15} {:<6.2f} {:<6.2f} {:<10} {:.5f}  {:<10.5f}  {:.5f}  {:<10.5f} {:<8} {:<7}"
 SUMMARY_FORMAT = (
     Style.RESET_ALL + "--------------------------\n" +
     Fore.GREEN + " vCPU: {0:.2f}\n RAM: {1:.2f}\n OS: {2}\n Region: {3}\n" +
@@ -53,7 +53,7 @@ def get_sanitized_args(testing: bool) -> List[str]:
     
     return sanitized_args
 
-def get_sys_argv(pp_args: List[str]) -> Tuple[bool, bool, float, float, str, str]:
+def get_sys_argv(pp_args: List[str]) -> Tuple[bool, bool, bool, float, float, str, str]:
     """
     Parse and validate command line arguments.
 
@@ -64,6 +64,7 @@ def get_sys_argv(pp_args: List[str]) -> Tuple[bool, bool, float, float, str, str
         Tuple containing:
         - success: Boolean indicating if parsing was successful
         - text_only: Boolean for text-only output
+        - ranked: Boolean for spot-aware ranking instead of on-demand price order
         - vcpu: Number of virtual CPUs
         - ram: Amount of RAM in GB
         - os: Operating system
@@ -74,16 +75,17 @@ def get_sys_argv(pp_args: List[str]) -> Tuple[bool, bool, float, float, str, str
     """
     if len(pp_args) == 1:
         print('no parameters. Check help with -h')
-        return False, False, 0, 0, '', ''
+        return False, False, False, 0, 0, '', ''
 
     if pp_args[1] == '-h':
         print_help()
-        return False, False, 0, 0, '', ''
+        return False, False, False, 0, 0, '', ''
 
-    text_only = pp_args[1] == '-t'
+    ranked = pp_args[1] == '-s'
+    text_only = pp_args[1] == '-t' or ranked
     if not text_only and pp_args[1] != '-h':
         print('incorrect parameter check help with -h')
-        return False, False, 0, 0, '', ''
+        return False, False, False, 0, 0, '', ''
 
     # Default values
     vcpu, ram = P_VCPU, P_RAM
@@ -95,7 +97,7 @@ def get_sys_argv(pp_args: List[str]) -> Tuple[bool, bool, float, float, str, str
             vcpu = float(pp_args[2])
         except ValueError:
             print('Please use an integer or floating number for vCPU')
-            return False, False, 0, 0, '', ''
+            return False, False, False, 0, 0, '', ''
 
     # Parse RAM
     if len(pp_args) > 3:
@@ -103,28 +105,29 @@ def get_sys_argv(pp_args: List[str]) -> Tuple[bool, bool, float, float, str, str
             ram = float(pp_args[3])
         except ValueError:
             print('Please use an integer or floating number for RAM')
-            return False, False, 0, 0, '', ''
+            return False, False, False, 0, 0, '', ''
 
     # Parse OS
     if len(pp_args) > 4:
         os_type = pp_args[4]
         if os_type not in list_os:
             print("Enter one of the values for os:", list_os)
-            return False, False, 0, 0, '', ''
+            return False, False, False, 0, 0, '', ''
 
     # Parse Region
     if len(pp_args) > 5:
         region = pp_args[5]
         if region not in list_regions:
             print("Enter one of the values for regions. Check help with -h")
-            return False, False, 0, 0, '', ''
+            return False, False, False, 0, 0, '', ''
 
-    return True, text_only, vcpu, ram, os_type, region
+    return True, text_only, ranked, vcpu, ram, os_type, region
 
 def print_instance_details(
     result_row: tuple,
     spot_price: float,
-    kill_rate: str
+    kill_rate: str,
+    savings: int = 0
 ) -> None:
     """
     Print formatted instance details including pricing information.
@@ -133,6 +136,7 @@ def print_instance_details(
         result_row: Tuple containing instance information from find_ec2
         spot_price: Hourly spot price
         kill_rate: Instance interruption rate
+        savings: Spot Advisor savings over on-demand in percent, 0 if unknown
     """
     instance = result_row[1]  # Instance name is at index 1
     vcpu = result_row[2]      # vCPU is at index 2
@@ -145,9 +149,50 @@ def print_instance_details(
 
     print(Fore.GREEN + INSTANCE_FORMAT.format(
         instance, vcpu, ram, os_type, price, price_monthly,
-        spot_price, spot_price_monthly, kill_rate
+        spot_price, spot_price_monthly, kill_rate, f"{savings}%" if savings else ''
     ))
 
+def get_instance_rows(
+    ranked: bool,
+    vcpu: float,
+    ram: float,
+    os_type: str,
+    region: str
+) -> List[Tuple[tuple, float, str, int]]:
+    """
+    Collect the instances to print along with their spot details.
+
+    Args:
+        ranked: Use spot-aware ranking instead of on-demand price order
+        vcpu: Number of virtual CPUs
+        ram: Amount of RAM in GB
+        os_type: Operating system
+        region: AWS region
+
+    Returns:
+        List of (result_row, spot_price, kill_rate, savings) tuples
+    """
+    if ranked:
+        return [
+            (row, spot_price, kill_rate, savings)
+            for row, spot_price, kill_rate, savings, _ in rank_ec2(
+                cpu=vcpu, ram=ram, os=os_type, region=region, limit=MAX_EC2_RESULTS
+            )
+        ]
+
+    result = find_ec2(cpu=vcpu, ram=ram, os=os_type, region=region, limit=MAX_EC2_RESULTS)
+    instances = [r[1] for r in result]
+    spot_prices = get_ec2_spot_price(instances=instances, os=os_type, region=region)
+    spot_interrupt_rates, spot_savings = get_ec2_spot_advice(
+        instances=instances,
+        os=os_type,
+        region=region_map[region]
+    )
+    return [
+        (row, spot_prices[row[1]], spot_interrupt_rates[row[1]], spot_savings[row[1]])
+        for row in result
+    ]
+
 def main(testing: bool = False) -> Optional[bool]:
     """
     Main function to process EC2 instance pricing information.
@@ -159,33 +204,22 @@ def main(testing: bool = False) -> Optional[bool]:
         Boolean indicating success in test mode, None otherwise
     """
     pp_args = get_sanitized_args(testing)
-    success, text_only, vcpu, ram, os_type, region = get_sys_argv(pp_args)
+    success, text_only, ranked, vcpu, ram, os_type, region = get_sys_argv(pp_args)
 
     if not success:
         sys.exit()
 
     if text_only:
-        result = find_ec2(cpu=vcpu, ram=ram, os=os_type, region=region, limit=MAX_EC2_RESULTS)
+        rows = get_instance_rows(ranked, vcpu, ram, os_type, region)
         print(Fore.GREEN + SUMMARY_FORMAT.format(vcpu, ram, os_type, region))
         
         print(Fore.LIGHTGREEN_EX + HEADER_FORMAT.format(
-            "Instance", "vCPU", "RAM", "OS", "PriceH", "PriceM", "SpotH", "SpotM", "KillRate"
+            "Instance", "vCPU", "RAM", "OS", "PriceH", "PriceM",
+            "SpotH", "SpotM", "KillRate", "Savings"
         ))
 
-        instances = [r[1] for r in result]
-        spot_prices = get_ec2_spot_price(instances=instances, os=os_type, region=region)
-        spot_interrupt_rates = get_ec2_spot_interruption(
-            instances=instances,
-            os=os_type,
-            region=region_map[region]
-        )
-
-        for row in result:
-            print_instance_details(
-                row,
-                spot_prices[row[1]],
-                spot_interrupt_rates[row[1]]
-            )
+        for row, spot_price, kill_rate, savings in rows:
+            print_instance_details(row, spot_price, kill_rate, savings)
 
         print(Style.RESET_ALL)
         if testing:
@@ -6,10 +6,21 @@ It handles AWS pricing API interactions, database operations, and various helper
 for retrieving and managing EC2 instance pricing information.
 """
 
+import codecs
+import heapq
 import json
+import os as os_module
+import re
 import sqlite3
-from datetime import date
-from typing import List, Dict, Tuple, Optional, Any, DefaultDict
+import stat
+import tempfile
+from contextlib import closing
+from datetime import date, datetime, timezone
+from pathlib import Path
+from typing import (
+    List, Dict, Tuple, Optional, Any, DefaultDict,
+    Iterable, Iterator, Sequence, Collection
+)
 from collections import defaultdict
 import yaml
 import boto3
@@ -25,10 +36,33 @@ REGION_NVIRGINIA = 'US East (N. Virginia)'
 P_REGION = REGION_NVIRGINIA
 DB_RECORD_EXPIRY_DAYS = 7
 MAX_RESULTS = 100
+DB_SHARDED = False
+MAX_ATTACHED_SHARDS = 10  # SQLite's default SQLITE_MAX_ATTACHED
 
 # AWS specific constants
 AWS_SERVICE_CODE = 'AmazonEC2'
 SPOT_ADVISOR_URL = "https://spot-bid-advisor.s3.amazonaws.com/spot-advisor-data.json"
+SPOT_ADVISOR_CHUNK_SIZE = 64 * 1024
+SPOT_INTERRUPTION_RATES = {
+    0: "<5%",
+    1: "5-10%",
+    2: "10-15%",
+    3: "15-20%",
+    4: ">20%"
+}
+WORST_INTERRUPTION_BUCKET = max(SPOT_INTERRUPTION_RATES)
+SPOT_PRICE_BATCH_SIZE = 20  # instance types per describe_spot_price_history call
+
+# Ranking constants: how many on-demand matches are scored, and the default
+# criterion weights (lower score is better; see RankingEngine)
+RANK_CANDIDATES = MAX_RESULTS
+DEFAULT_RANK_WEIGHTS = {
+    'price': 0.5,
+    'spot_price': 1.0,
+    'interruption': 0.5,
+    'price_per_vcpu': 0.0,
+    'price_per_gib': 0.0
+}
 
 # EC2 filter constants
 EC2_FILTERS = {
@@ -89,23 +123,225 @@ def convert_date(val: str) -> date:
 sqlite3.register_adapter(date, adapt_date)
 sqlite3.register_converter("DATE", convert_date)
 
+class SpotAdvisorStream:
+    """
+    Incremental reader for the Spot Advisor document.
+
+    Consumes the JSON text chunk by chunk and only decodes the entries that are
+    asked for; every other value is skipped without building Python objects,
+    so memory stays bounded by the chunk size plus the selected entries.
+    """
+
+    _STRUCT_RE = re.compile(r'["{}\[\]]')
+    _STRING_RE = re.compile(r'["\\]')
+    _SCALAR_END_RE = re.compile(r'[,}\]\s]')
+
+    def __init__(self, chunks: Iterable[str]):
+        self._chunks = iter(chunks)
+        self._buf = ''
+        self._pos = 0
+        self._mark: Optional[int] = None
+
+    def select(self, path: Sequence[str], keys: Optional[Collection[str]] = None) -> Dict[str, Any]:
+        """Return the members of the object at path, restricted to keys if given."""
+        if not self._descend(path):
+            return {}
+
+        wanted = None if keys is None else set(keys)
+        results = {}
+        for key in self._iter_object():
+            if wanted is None or key in wanted:
+                results[key] = self._read_value()
+                if wanted is not None and len(results) == len(wanted):
+                    break
+            else:
+                self._skip_value()
+        return results
+
+    def _descend(self, path: Sequence[str]) -> bool:
+        """Advance to the value found by following path through nested objects."""
+        for name in path:
+            if self._peek() != '{':
+                return False
+            for key in self._iter_object():
+                if key == name:
+                    break
+                self._skip_value()
+            else:
+                return False
+        return True
+
+    def _fill(self) -> bool:
+        """Drop consumed text and append the next chunk to the buffer."""
+        chunk = next(self._chunks, None)
+        if chunk is None:
+            return False
+        keep = self._pos if self._mark is None else self._mark
+        self._buf = self._buf[keep:] + chunk
+        self._pos -= keep
+        if self._mark is not None:
+            self._mark -= keep
+        return True
+
+    def _peek(self) -> str:
+        """Skip whitespace and return the next character, or '' at the end."""
+        while True:
+            while self._pos < len(self._buf) and self._buf[self._pos].isspace():
+                self._pos += 1
+            if self._pos < len(self._buf):
+                return self._buf[self._pos]
+            if not self._fill():
+                return ''
+
+    def _expect(self, char: str) -> None:
+        """Consume char or raise ValueError."""
+        if self._peek() != char:
+            raise ValueError(f"Expected '{char}' in Spot Advisor data")
+        self._pos += 1
+
+    def _iter_object(self) -> Iterator[str]:
+        """Yield object keys; the caller must consume each value before resuming."""
+        self._expect('{')
+        if self._peek() == '}':
+            self._pos += 1
+            return
+        while True:
+            key = self._read_string()
+            self._expect(':')
+            yield key
+            char = self._peek()
+            self._pos += 1
+            if char == '}':
+                return
+            if char != ',':
+                raise ValueError("Malformed object in Spot Advisor data")
+
+    def _read_string(self) -> str:
+        """Decode the next JSON string."""
+        self._peek()
+        self._mark = self._pos
+        self._skip_string()
+        text = self._buf[self._mark:self._pos]
+        self._mark = None
+        return json.loads(text)
+
+    def _read_value(self) -> Any:
+        """Decode the next JSON value."""
+        self._peek()
+        self._mark = self._pos
+        self._skip_value()
+        text = self._buf[self._mark:self._pos]
+        self._mark = None
+        return json.loads(text)
+
+    def _skip_string(self) -> None:
+        """Advance past the next JSON string."""
+        self._expect('"')
+        while True:
+            match = self._STRING_RE.search(self._buf, self._pos)
+            if match is None:
+                self._pos = len(self._buf)
+            elif match.group() == '"':
+                self._pos = match.end()
+                return
+            elif match.end() < len(self._buf):
+                self._pos = match.end() + 1
+                continue
+            else:
+                self._pos = match.start()
+            if not self._fill():
+                raise ValueError("Truncated string in Spot Advisor data")
+
+    def _skip_value(self) -> None:
+        """Advance past the next JSON value."""
+        char = self._peek()
+        if char == '"':
+            self._skip_string()
+        elif char in ('{', '['):
+            depth = 0
+            while True:
+                match = self._STRUCT_RE.search(self._buf, self._pos)
+                if match is None:
+                    self._pos = len(self._buf)
+                    if not self._fill():
+                        raise ValueError("Truncated value in Spot Advisor data")
+                    continue
+                token = match.group()
+                self._pos = match.start()
+                if token == '"':
+                    self._skip_string()
+                    continue
+                self._pos += 1
+                depth += 1 if token in '{[' else -1
+                if depth == 0:
+                    return
+        elif char:
+            while True:
+                match = self._SCALAR_END_RE.search(self._buf, self._pos)
+                if match is not None:
+                    self._pos = match.start()
+                    return
+                self._pos = len(self._buf)
+                if not self._fill():
+                    return
+        else:
+            raise ValueError("Unexpected end of Spot Advisor data")
+
+def spot_kill_rate(advice: Dict) -> str:
+    """Return the interruption rate label of a Spot Advisor entry, or '' if unknown."""
+    try:
+        return SPOT_INTERRUPTION_RATES.get(advice['r'], '')
+    except (KeyError, TypeError):
+        return ''
+
+def spot_savings(advice: Dict) -> int:
+    """Return the savings percentage of a Spot Advisor entry, or 0 if unknown or malformed."""
+    try:
+        return int(advice['s'])
+    except (KeyError, TypeError, ValueError, OverflowError):
+        return 0
+
 class DatabaseManager:
-    """Handles all database operations for EC2 pricing data."""
-    
-    def __init__(self, db_name: str = DB_NAME):
+    """
+    Handles all database operations for EC2 pricing data.
+
+    By default every region lives in the single ``ec2`` table of db_name. With
+    sharded=True each region is stored in its own file next to db_name (e.g.
+    ``awsprices.us-east-1.db``); shards are attached to a query connection only
+    when a query needs them, and a region is refreshed by building a new shard
+    and renaming it over the old one.
+    """
+
+    def __init__(self, db_name: str = DB_NAME, sharded: bool = DB_SHARDED):
         self.db_name = db_name
-        self.create_db()
+        self.sharded = sharded
+        if not sharded:
+            self.create_db()
 
-    def _get_connection(self) -> sqlite3.Connection:
+    def _get_connection(self, db_name: Optional[str] = None,
+                        uri: bool = False) -> sqlite3.Connection:
         """Create a connection with proper date handling."""
         return sqlite3.connect(
-            self.db_name,
-            detect_types=sqlite3.PARSE_DECLTYPES | sqlite3.PARSE_COLNAMES
+            db_name or self.db_name,
+            detect_types=sqlite3.PARSE_DECLTYPES | sqlite3.PARSE_COLNAMES,
+            uri=uri
         )
 
-    def create_db(self) -> None:
+    def _get_query_connection(self) -> sqlite3.Connection:
+        """Create a connection for reads; in sharded mode shards are attached to it."""
+        if self.sharded:
+            return self._get_connection('file::memory:', uri=True)
+        return self._get_connection()
+
+    def shard_path(self, region: str) -> Path:
+        """Return the shard file used for a region in sharded mode."""
+        code = region_map.get(region) or re.sub(r'[^A-Za-z0-9_-]+', '_', region)
+        base = Path(self.db_name)
+        return base.with_name(f"{base.stem}.{code}{base.suffix}")
+
+    def create_db(self, db_name: Optional[str] = None) -> None:
         """Create the database and required tables if they don't exist."""
-        with self._get_connection() as conn:
+        with closing(self._get_connection(db_name)) as conn:
             cursor = conn.cursor()
             sql_query = """
                 CREATE TABLE IF NOT EXISTS ec2(
@@ -122,29 +358,106 @@ class DatabaseManager:
             cursor.execute(sql_query)
             conn.commit()
 
+    def _insert(self, conn: sqlite3.Connection, records: List[Tuple]) -> None:
+        """Insert records through an open connection."""
+        conn.executemany(
+            """INSERT INTO ec2(instanceType, vcpu, memory, os, price, region, add_date)
+               VALUES(?, ?, ?, ?, ?, ?, ?)""",
+            records
+        )
+
     def insert_records(self, records: List[Tuple]) -> None:
         """Insert multiple EC2 pricing records into the database."""
-        with self._get_connection() as conn:
-            cursor = conn.cursor()
-            cursor.executemany(
-                """INSERT INTO ec2(instanceType, vcpu, memory, os, price, region, add_date)
-                   VALUES(?, ?, ?, ?, ?, ?, ?)""",
-                records
-            )
-            conn.commit()
+        if not self.sharded:
+            with closing(self._get_connection()) as conn:
+                self._insert(conn, records)
+                conn.commit()
+            return
+
+        by_region = defaultdict(list)
+        for record in records:
+            by_region[record[5]].append(record)
+        for region, region_records in by_region.items():
+            shard = str(self.shard_path(region))
+            self.create_db(shard)
+            with closing(self._get_connection(shard)) as conn:
+                self._insert(conn, region_records)
+                conn.commit()
+
+    def replace_records(self, region: str, records: List[Tuple]) -> None:
+        """Replace all records of a region in one step."""
+        if not self.sharded:
+            with closing(self._get_connection()) as conn:
+                conn.execute("DELETE FROM ec2 WHERE region=?", (region,))
+                self._insert(conn, records)
+                conn.commit()
+            return
+
+        # A private temp file per refresh, so concurrent refreshes of the same
+        # region never write into each other's shard before the rename.
+        shard = self.shard_path(region)
+        fd, tmp_name = tempfile.mkstemp(dir=shard.parent, prefix=shard.name + '.', suffix='.tmp')
+        os_module.close(fd)
+        tmp_shard = Path(tmp_name)
+        try:
+            # mkstemp creates 0600 files; keep the permissions a shard gets from SQLite
+            tmp_shard.chmod(self._shard_mode(shard))
+            self.create_db(tmp_name)
+            with closing(self._get_connection(tmp_name)) as conn:
+                self._insert(conn, records)
+                conn.commit()
+            tmp_shard.replace(shard)
+        except BaseException:
+            tmp_shard.unlink(missing_ok=True)
+            raise
+
+    @staticmethod
+    def _shard_mode(shard: Path) -> int:
+        """Return the existing shard's mode, or the one SQLite would create it with."""
+        try:
+            return stat.S_IMODE(shard.stat().st_mode)
+        except FileNotFoundError:
+            umask = os_module.umask(0)
+            os_module.umask(umask)
+            return 0o644 & ~umask
 
     def delete_records(self, region: str) -> None:
         """Delete records for a specific region."""
-        with self._get_connection() as conn:
+        if self.sharded:
+            self.shard_path(region).unlink(missing_ok=True)
+            return
+
+        with closing(self._get_connection()) as conn:
             cursor = conn.cursor()
             cursor.execute("DELETE FROM ec2 WHERE region=?", (region,))
             conn.commit()
 
+    def _attach_shards(self, conn: sqlite3.Connection, regions: List[str]) -> List[str]:
+        """Attach the existing shards of regions read-only and return their schema names."""
+        schemas = []
+        for region in regions:
+            schema = f"shard{len(schemas)}"
+            shard_uri = self.shard_path(region).resolve().as_uri() + '?mode=ro'
+            try:
+                # Read-only, so a shard deleted meanwhile is skipped instead of recreated empty
+                conn.execute(f"ATTACH DATABASE ? AS {schema}", (shard_uri,))
+            except sqlite3.OperationalError:
+                continue
+            schemas.append(schema)
+        return schemas
+
     def are_records_old(self, region: str) -> bool:
         """Check if records for a region are older than DB_RECORD_EXPIRY_DAYS."""
-        with self._get_connection() as conn:
+        with closing(self._get_query_connection()) as conn:
+            table = 'ec2'
+            if self.sharded:
+                schemas = self._attach_shards(conn, [region])
+                if not schemas:
+                    return True
+                table = f"{schemas[0]}.ec2"
+
             cursor = conn.cursor()
-            cursor.execute("SELECT add_date FROM ec2 WHERE region=? LIMIT 1", (region,))
+            cursor.execute(f"SELECT add_date FROM {table} WHERE region=? LIMIT 1", (region,))
             result = cursor.fetchone()
             
             if not result:
@@ -155,16 +468,40 @@ class DatabaseManager:
 
     def find_ec2(self, cpu: float, ram: float, os: str, region: str, limit: int) -> List[Tuple]:
         """Find EC2 instances matching the specified criteria."""
-        with self._get_connection() as conn:
-            cursor = conn.cursor()
-            sql_query = """
-                SELECT * FROM ec2
-                WHERE vcpu >= ? AND memory >= ?
-                AND region = ? AND os = ?
-                ORDER BY price LIMIT ?
-            """
-            cursor.execute(sql_query, (cpu, ram, region, os, limit))
-            return cursor.fetchall()
+        return self.find_ec2_regions(cpu, ram, os, [region], limit)
+
+    def find_ec2_regions(self, cpu: float, ram: float, os: str,
+                         regions: List[str], limit: int) -> List[Tuple]:
+        """Find the cheapest matching EC2 instances across several regions."""
+        if not self.sharded:
+            with closing(self._get_connection()) as conn:
+                cursor = conn.cursor()
+                sql_query = f"""
+                    SELECT * FROM ec2
+                    WHERE vcpu >= ? AND memory >= ?
+                    AND region IN ({', '.join('?' * len(regions))}) AND os = ?
+                    ORDER BY price LIMIT ?
+                """
+                cursor.execute(sql_query, (cpu, ram, *regions, os, limit))
+                return cursor.fetchall()
+
+        # SQLite caps the number of attached databases, so query in batches
+        # and keep the cheapest rows over all of them.
+        results = []
+        for start in range(0, len(regions), MAX_ATTACHED_SHARDS):
+            batch = regions[start:start + MAX_ATTACHED_SHARDS]
+            with closing(self._get_query_connection()) as conn:
+                schemas = self._attach_shards(conn, batch)
+                if not schemas:
+                    continue
+                sql_query = " UNION ALL ".join(
+                    f"SELECT * FROM {schema}.ec2 WHERE vcpu >= ? AND memory >= ? AND os = ?"
+                    for schema in schemas
+                ) + " ORDER BY price LIMIT ?"
+                cursor = conn.cursor()
+                cursor.execute(sql_query, (cpu, ram, os) * len(schemas) + (limit,))
+                results.extend(cursor.fetchall())
+        return heapq.nsmallest(limit, results, key=lambda row: row[5])
 
 class AWSPricing:
     """Handles AWS pricing API interactions."""
@@ -197,7 +534,6 @@ class AWSPricing:
             return
 
         print("Getting price updates for EC2s")
-        self.db.delete_records(region)
         pricing, _ = self.get_boto_clients(region)
 
         filters = [
@@ -227,7 +563,7 @@ class AWSPricing:
             if not next_token:
                 break
 
-        self.db.insert_records(records)
+        self.db.replace_records(region, records)
 
     def _parse_price_list_item(self, price: str, region: str) -> Optional[Tuple]:
         """Parse a price list item into a database record."""
@@ -254,49 +590,232 @@ class AWSPricing:
             return None
 
     def get_spot_prices(self, instances: List[str], os: str, region: str) -> DefaultDict:
-        """Get spot prices for specified instances."""
+        """Get current spot prices for specified instances, batching the API calls."""
         _, ec2 = self.get_boto_clients(region)
         results = defaultdict(float)
+        latest = {}
 
-        for instance in instances:
+        # One entry per availability zone; keep the most recent per type
+        for spot in self._describe_spot_prices(ec2, instances, os):
             try:
-                spot = ec2.describe_spot_price_history(
-                    InstanceTypes=[instance],
-                    MaxResults=1,
-                    ProductDescriptions=[os_map[os]]
-                )
-                if spot['SpotPriceHistory']:
-                    results[instance] = float(spot['SpotPriceHistory'][0]['SpotPrice'])
-            except (IndexError, KeyError):
+                instance, timestamp = spot['InstanceType'], spot['Timestamp']
+                price = float(spot['SpotPrice'])
+            except (KeyError, ValueError):
                 continue
+            if instance not in latest or timestamp > latest[instance]:
+                latest[instance] = timestamp
+                results[instance] = price
 
         return results
 
+    @staticmethod
+    def _describe_spot_prices(ec2: Any, instances: List[str], os: str) -> Iterator[Dict]:
+        """Yield current spot price entries, SPOT_PRICE_BATCH_SIZE types per API call."""
+        now = datetime.now(timezone.utc)
+        for start in range(0, len(instances), SPOT_PRICE_BATCH_SIZE):
+            kwargs = {
+                'InstanceTypes': instances[start:start + SPOT_PRICE_BATCH_SIZE],
+                'ProductDescriptions': [os_map[os]],
+                'StartTime': now
+            }
+            while True:
+                response = ec2.describe_spot_price_history(**kwargs)
+                yield from response.get('SpotPriceHistory', [])
+
+                next_token = response.get('NextToken')
+                if not next_token:
+                    break
+                kwargs['NextToken'] = next_token
+
+    def get_spot_advisor(self, instances: List[str], os: str, region: str) -> Dict[str, Dict]:
+        """Stream the Spot Advisor document and keep only the requested entries."""
+        try:
+            response = requests.get(SPOT_ADVISOR_URL, stream=True)
+        except requests.exceptions.RequestException:
+            return {}
+
+        try:
+            stream = SpotAdvisorStream(
+                codecs.iterdecode(response.iter_content(SPOT_ADVISOR_CHUNK_SIZE), 'utf-8')
+            )
+            return stream.select(('spot_advisor', region, os), instances)
+        except (requests.exceptions.RequestException, ValueError):
+            return {}
+        finally:
+            response.close()
+
+    def get_spot_advice(self, instances: List[str], os: str,
+                        region: str) -> Tuple[DefaultDict, DefaultDict]:
+        """Get spot interruption rates and savings percentages from one Spot Advisor read."""
+        rates = defaultdict(str)
+        savings = defaultdict(int)
+
+        for instance, advice in self.get_spot_advisor(instances, os, region).items():
+            if spot_kill_rate(advice):
+                rates[instance] = spot_kill_rate(advice)
+            if spot_savings(advice):
+                savings[instance] = spot_savings(advice)
+
+        return rates, savings
+
     def get_spot_interruption_rates(self, instances: List[str], os: str, region: str) -> DefaultDict:
         """Get spot interruption rates for specified instances."""
-        results = defaultdict(str)
-        rates = {
-            0: "<5%",
-            1: "5-10%",
-            2: "10-15%",
-            3: "15-20%",
-            4: ">20%"
-        }
+        return self.get_spot_advice(instances, os, region)[0]
+
+    def get_spot_savings(self, instances: List[str], os: str, region: str) -> DefaultDict:
+        """Get spot savings over on-demand, in percent, for specified instances."""
+        return self.get_spot_advice(instances, os, region)[1]
+
+# (row, spot_price, kill_rate, savings, score) as returned by RankingEngine.rank
+RankedInstance = Tuple[Tuple, float, str, int, float]
+
+class RankingEngine:
+    """
+    Ranks EC2 candidates by user-weighted cost and spot criteria.
+
+    Every criterion is scaled to be comparable: prices are divided by the
+    cheapest matching value among the candidates and the interruption bucket by
+    the worst bucket, so a score of 1.0 per unit weight means "as good as the
+    best on-demand option". Lower scores are better.
+
+    Spot prices need API calls, so they are fetched lazily in batches of
+    SPOT_PRICE_BATCH_SIZE. Candidates are visited in order of their score
+    without the spot term, which is a lower bound on the full score, with the
+    Spot Advisor savings estimate as tie-breaker; the search stops as soon as
+    no remaining candidate can beat the current top-k. The result is the exact
+    top-k, and the number of lookups is bounded by the candidate count.
+    """
+
+    def __init__(self, aws_pricing: 'AWSPricing', weights: Optional[Dict[str, float]] = None):
+        unknown = set(weights or {}) - set(DEFAULT_RANK_WEIGHTS)
+        if unknown:
+            raise ValueError(f"Unknown ranking criteria: {sorted(unknown)}")
+        self.aws_pricing = aws_pricing
+        self.weights = {**DEFAULT_RANK_WEIGHTS, **(weights or {})}
+        if any(weight < 0 for weight in self.weights.values()):
+            raise ValueError("Ranking weights must not be negative")
+
+    def rank(self, candidates: List[Tuple], os: str, region: str,
+             limit: int) -> List[RankedInstance]:
+        """
+        Return the best candidates as (row, spot_price, kill_rate, savings, score) tuples.
+
+        candidates are rows as returned by DatabaseManager.find_ec2 and region is
+        the region name used in the database.
+        """
+        if limit <= 0 or not candidates:
+            return []
+
+        advice = None
+        if self.weights['interruption'] or self.weights['spot_price']:
+            advice = self.aws_pricing.get_spot_advisor(
+                [row[1] for row in candidates], os, region_map.get(region, region)
+            )
 
-        try:
-            response = requests.get(SPOT_ADVISOR_URL)
-            spot_advisor = json.loads(response.text)['spot_advisor']
-            
-            for instance in instances:
-                try:
-                    rate = spot_advisor[region][os][instance]['r']
-                    results[instance] = rates[rate]
-                except (KeyError, IndexError):
-                    continue
+        ref_price = min(row[5] for row in candidates)
+        pending = self._pending_heap(candidates, advice or {}, ref_price)
 
-        except requests.exceptions.RequestException:
-            pass
+        # Max-heap of the best `limit` scores seen so far; the root is the worst kept
+        top: List[Tuple[float, int]] = []
+        spot_prices: Dict[str, float] = {}
+
+        while True:
+            batch = self._next_batch(pending, top, limit)
+            if not batch:
+                break
 
+            if self.weights['spot_price']:
+                spot_prices.update(self.aws_pricing.get_spot_prices(
+                    [candidates[index][1] for _, _, index in batch], os, region
+                ))
+
+            for bound, _, index in batch:
+                spot_price = spot_prices.get(candidates[index][1], 0.0)
+                self._keep_best(top, limit, index,
+                                bound + self._spot_score(candidates[index], spot_price, ref_price))
+
+        ranked = [(candidates[-index], -score) for score, index in sorted(top, reverse=True)]
+        return self._with_spot_details(ranked, spot_prices, advice, os, region)
+
+    @staticmethod
+    def _next_batch(pending: List[Tuple[float, float, int]], top: List[Tuple[float, int]],
+                    limit: int) -> List[Tuple[float, float, int]]:
+        """Pop up to SPOT_PRICE_BATCH_SIZE candidates that can still beat the top-k."""
+        batch = []
+        while pending and len(batch) < SPOT_PRICE_BATCH_SIZE:
+            if len(top) == limit and -top[0][0] <= pending[0][0]:
+                break
+            batch.append(heapq.heappop(pending))
+        return batch
+
+    @staticmethod
+    def _keep_best(top: List[Tuple[float, int]], limit: int, index: int, score: float) -> None:
+        """Add a scored candidate to the bounded top-k heap if it qualifies."""
+        item = (-score, -index)
+        if len(top) < limit:
+            heapq.heappush(top, item)
+        elif item > top[0]:
+            heapq.heapreplace(top, item)
+
+    def _pending_heap(self, candidates: List[Tuple], advice: Dict[str, Dict],
+                      ref_price: float) -> List[Tuple[float, float, int]]:
+        """Build the (lower bound, estimated score, index) heap of candidates to visit."""
+        ref_vcpu = min((row[5] / row[2] for row in candidates if row[2] > 0), default=1.0)
+        ref_gib = min((row[5] / row[3] for row in candidates if row[3] > 0), default=1.0)
+
+        pending = []
+        for index, row in enumerate(candidates):
+            bound = self._base_score(row, advice, ref_price, ref_vcpu, ref_gib)
+            estimate = bound + self._spot_score(row, self._estimate_spot_price(row, advice),
+                                                ref_price)
+            pending.append((bound, estimate, index))
+        heapq.heapify(pending)
+        return pending
+
+    def _base_score(self, row: Tuple, advice: Dict[str, Dict],
+                    ref_price: float, ref_vcpu: float, ref_gib: float) -> float:
+        """Score a candidate on every criterion except the spot price."""
+        price, vcpu, memory = row[5], row[2], row[3]
+        score = self.weights['price'] * price / ref_price
+        if self.weights['interruption']:
+            bucket = advice.get(row[1], {}).get('r', WORST_INTERRUPTION_BUCKET)
+            score += self.weights['interruption'] * bucket / WORST_INTERRUPTION_BUCKET
+        if self.weights['price_per_vcpu'] and vcpu > 0:
+            score += self.weights['price_per_vcpu'] * price / vcpu / ref_vcpu
+        if self.weights['price_per_gib'] and memory > 0:
+            score += self.weights['price_per_gib'] * price / memory / ref_gib
+        return score
+
+    def _spot_score(self, row: Tuple, spot_price: float, ref_price: float) -> float:
+        """Score the spot price term of a candidate."""
+        # Without a spot market the instance can only be bought on-demand
+        return self.weights['spot_price'] * (spot_price or row[5]) / ref_price
+
+    @staticmethod
+    def _estimate_spot_price(row: Tuple, advice: Dict[str, Dict]) -> float:
+        """Estimate the spot price from the Spot Advisor savings over on-demand."""
+        return row[5] * (100 - spot_savings(advice.get(row[1], {}))) / 100
+
+    def _with_spot_details(self, ranked: List[Tuple[Tuple, float]], spot_prices: Dict[str, float],
+                           advice: Optional[Dict[str, Dict]], os: str,
+                           region: str) -> List[RankedInstance]:
+        """Attach spot prices, kill rates and savings, fetching what ranking did not need."""
+        names = [row[1] for row, _ in ranked]
+        if not self.weights['spot_price']:
+            spot_prices = self.aws_pricing.get_spot_prices(names, os, region)
+        if advice is None:
+            advice = self.aws_pricing.get_spot_advisor(names, os, region_map.get(region, region))
+
+        results = []
+        for row, score in ranked:
+            entry = advice.get(row[1], {})
+            results.append((
+                row,
+                spot_prices.get(row[1], 0.0),
+                spot_kill_rate(entry),
+                spot_savings(entry),
+                score
+            ))
         return results
 
 def print_help() -> None:
@@ -305,6 +824,7 @@ def print_help() -> None:
     print(Fore.GREEN + "Sample command:\n$ python awsEC2pricing.py -t 1 16 Windows 'US East (N. Virginia)'")
     print(Style.RESET_ALL + "----------------------------------")
     print(Fore.GREEN + " -t                      --> run in terminal")
+    print(" -s                      --> run in terminal, ranked by spot price and kill rate")
     print(" 1                       --> vCPU")
     print(" 16                      --> RAM")
     print(" Windows                 --> OS")
@@ -326,6 +846,15 @@ def find_ec2(cpu: float = P_VCPU, ram: float = P_RAM,
     aws_pricing.get_ec2_pricing(region)
     return aws_pricing.db.find_ec2(cpu, ram, os, region, limit)
 
+def rank_ec2(cpu: float = P_VCPU, ram: float = P_RAM, os: str = P_OS,
+             region: str = P_REGION, limit: int = 6,
+             weights: Optional[Dict[str, float]] = None) -> List[RankedInstance]:
+    """Rank EC2 instances matching the criteria with spot-aware weights."""
+    aws_pricing = AWSPricing()
+    aws_pricing.get_ec2_pricing(region)
+    candidates = aws_pricing.db.find_ec2(cpu, ram, os, region, max(limit, RANK_CANDIDATES))
+    return RankingEngine(aws_pricing, weights).rank(candidates, os, region, limit)
+
 def get_ec2_spot_price(instances: List[str], os: str, region: str) -> DefaultDict:
     """Get spot prices for specified instances."""
     aws_pricing = AWSPricing()
@@ -335,3 +864,14 @@ def get_ec2_spot_interruption(instances: List[str], os: str, region: str) -> Def
     """Get spot interruption rates for specified instances."""
     aws_pricing = AWSPricing()
     return aws_pricing.get_spot_interruption_rates(instances, os, region)
+
+def get_ec2_spot_advice(instances: List[str], os: str,
+                        region: str) -> Tuple[DefaultDict, DefaultDict]:
+    """Get spot interruption rates and savings for specified instances."""
+    aws_pricing = AWSPricing()
+    return aws_pricing.get_spot_advice(instances, os, region)
+
+def get_ec2_spot_savings(instances: List[str], os: str, region: str) -> DefaultDict:
+    """Get spot savings over on-demand for specified instances."""
+    aws_pricing = AWSPricing()
+    return aws_pricing.get_spot_savings(instances, os, region)
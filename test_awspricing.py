@@ -4,14 +4,19 @@ Test suite for AWS EC2 Price Finder
 
 import pytest
 from unittest.mock import patch, MagicMock
-from datetime import date
+from datetime import date, datetime, timedelta, timezone
+import math
+import os
+import stat
 import yaml
 import sqlite3
 
 from includes import (
     DatabaseManager, AWSPricing, print_help,
-    REGION_NVIRGINIA, region_map, P_OS,
-    find_ec2, get_ec2_spot_price, get_ec2_spot_interruption
+    REGION_NVIRGINIA, region_map, P_OS, list_regions,
+    find_ec2, get_ec2_spot_price, get_ec2_spot_interruption,
+    get_ec2_spot_savings, get_ec2_spot_advice, SpotAdvisorStream, RankingEngine,
+    SPOT_PRICE_BATCH_SIZE
 )
 from awsEC2pricing import get_sys_argv, main
 
@@ -29,6 +34,11 @@ def db_manager():
     if os.path.exists(TEST_DB):
         os.remove(TEST_DB)
 
+@pytest.fixture
+def sharded_db_manager(tmp_path):
+    """Fixture for database manager storing one shard per region."""
+    return DatabaseManager(str(tmp_path / TEST_DB), sharded=True)
+
 @pytest.fixture
 def aws_pricing():
     """Fixture for AWS pricing with mocked credentials."""
@@ -81,6 +91,90 @@ def test_records_expiry(db_manager):
     db_manager.insert_records([test_record])
     assert db_manager.are_records_old(REGION_NVIRGINIA) is False
 
+def test_replace_records(db_manager):
+    """Test replacing the records of one region."""
+    db_manager.insert_records([
+        ('t3.medium', 2, 4, 'Linux', 0.0416, REGION_NVIRGINIA, date.today()),
+        ('t3.medium', 2, 4, 'Linux', 0.0456, 'EU (Ireland)', date.today()),
+    ])
+    db_manager.replace_records(REGION_NVIRGINIA, [
+        ('t3.large', 2, 8, 'Linux', 0.0832, REGION_NVIRGINIA, date.today())
+    ])
+
+    results = db_manager.find_ec2(1, 2, 'Linux', REGION_NVIRGINIA, 10)
+    assert [row[1] for row in results] == ['t3.large']
+    assert len(db_manager.find_ec2(1, 2, 'Linux', 'EU (Ireland)', 10)) == 1
+
+def test_sharded_database_operations(sharded_db_manager):
+    """Test per-region shards for insert, query, replace and delete."""
+    assert sharded_db_manager.are_records_old(REGION_NVIRGINIA) is True
+    sharded_db_manager.insert_records([
+        ('t3.medium', 2, 4, 'Linux', 0.0416, REGION_NVIRGINIA, date.today()),
+        ('t3.medium', 2, 4, 'Linux', 0.0456, 'EU (Ireland)', date.today()),
+    ])
+    assert sharded_db_manager.shard_path(REGION_NVIRGINIA).name == 'test_awsprices.us-east-1.db'
+    assert sharded_db_manager.shard_path('EU (Ireland)').exists()
+    assert sharded_db_manager.are_records_old(REGION_NVIRGINIA) is False
+
+    results = sharded_db_manager.find_ec2(1, 2, 'Linux', REGION_NVIRGINIA, 10)
+    assert [(row[1], row[6]) for row in results] == [('t3.medium', REGION_NVIRGINIA)]
+
+    sharded_db_manager.replace_records(REGION_NVIRGINIA, [
+        ('t3.large', 2, 8, 'Linux', 0.0832, REGION_NVIRGINIA, date.today())
+    ])
+    results = sharded_db_manager.find_ec2(1, 2, 'Linux', REGION_NVIRGINIA, 10)
+    assert [row[1] for row in results] == ['t3.large']
+
+    sharded_db_manager.delete_records(REGION_NVIRGINIA)
+    assert sharded_db_manager.find_ec2(1, 2, 'Linux', REGION_NVIRGINIA, 10) == []
+    assert sharded_db_manager.are_records_old(REGION_NVIRGINIA) is True
+    # Querying a missing shard must not create an empty one
+    assert not sharded_db_manager.shard_path(REGION_NVIRGINIA).exists()
+
+def test_sharded_replace_failure(sharded_db_manager):
+    """Test that a failed shard rebuild keeps the old shard and leaves no temp file."""
+    shard_dir = sharded_db_manager.shard_path(REGION_NVIRGINIA).parent
+    sharded_db_manager.replace_records(REGION_NVIRGINIA, [
+        ('t3.medium', 2, 4, 'Linux', 0.0416, REGION_NVIRGINIA, date.today())
+    ])
+    assert not list(shard_dir.glob('*.tmp'))
+
+    with patch.object(sharded_db_manager, '_insert', side_effect=sqlite3.OperationalError):
+        with pytest.raises(sqlite3.OperationalError):
+            sharded_db_manager.replace_records(REGION_NVIRGINIA, [])
+
+    assert not list(shard_dir.glob('*.tmp'))
+    results = sharded_db_manager.find_ec2(1, 2, 'Linux', REGION_NVIRGINIA, 10)
+    assert [row[1] for row in results] == ['t3.medium']
+
+def test_sharded_replace_keeps_file_mode(sharded_db_manager):
+    """Test that rebuilt shards keep the permissions of freshly created ones."""
+    record = ('t3.medium', 2, 4, 'Linux', 0.0416, REGION_NVIRGINIA, date.today())
+    old_umask = os.umask(0o022)
+    try:
+        sharded_db_manager.insert_records([record])
+        shard = sharded_db_manager.shard_path(REGION_NVIRGINIA)
+        assert stat.S_IMODE(shard.stat().st_mode) == 0o644
+
+        sharded_db_manager.replace_records(REGION_NVIRGINIA, [record])
+        assert stat.S_IMODE(shard.stat().st_mode) == 0o644
+
+        sharded_db_manager.replace_records('EU (Ireland)', [record])
+        new_shard = sharded_db_manager.shard_path('EU (Ireland)')
+        assert stat.S_IMODE(new_shard.stat().st_mode) == 0o644
+    finally:
+        os.umask(old_umask)
+
+def test_sharded_cross_region_query(sharded_db_manager):
+    """Test cross-region queries over more shards than can be attached at once."""
+    sharded_db_manager.insert_records([
+        ('t3.medium', 2, 4, 'Linux', 0.05 + index / 1000, region, date.today())
+        for index, region in enumerate(reversed(list_regions))
+    ])
+
+    results = sharded_db_manager.find_ec2_regions(1, 2, 'Linux', list_regions, 3)
+    assert [row[6] for row in results] == list(reversed(list_regions))[:3]
+
 @patch('includes.boto3.Session')
 def test_aws_pricing_initialization(mock_session, aws_pricing):
     """Test AWS pricing initialization."""
@@ -91,7 +185,7 @@ def test_aws_pricing_initialization(mock_session, aws_pricing):
 def test_spot_interruption_rates(mock_get):
     """Test spot interruption rates retrieval."""
     mock_response = MagicMock()
-    mock_response.text = '''{
+    mock_response.iter_content.return_value = [b'''{
         "spot_advisor": {
             "us-east-1": {
                 "Linux": {
@@ -99,7 +193,7 @@ def test_spot_interruption_rates(mock_get):
                 }
             }
         }
-    }'''
+    }''']
     mock_get.return_value = mock_response
 
     rates = get_ec2_spot_interruption(
@@ -110,35 +204,270 @@ def test_spot_interruption_rates(mock_get):
     assert len(rates) == 1
     assert rates['t3.medium'] == '<5%'
 
+SPOT_ADVISOR_DOC = '''{
+    "global_rate": "<5%",
+    "instance_types": {"t3.medium": {"emr": true, "cores": 2, "ram_gb": 4.0}},
+    "spot_advisor": {
+        "eu-west-1": {"Linux": {"t3.medium": {"s": 70, "r": 4}}},
+        "us-east-1": {
+            "Windows": {"t3.medium": {"s": 40, "r": 1}},
+            "Linux": {
+                "t2.medium": {"s": 65, "r": 3},
+                "t3.medium": {"s": 68, "r": 0},
+                "m6g.large": {"s": 55, "r": 2}
+            }
+        }
+    },
+    "ranges": [{"index": 0, "label": "<5%", "note": "say \\"hi\\"", "max": 5}]
+}'''
+
+@pytest.mark.parametrize("chunk_size", [1, 7, 4096])
+def test_spot_advisor_stream_select(chunk_size):
+    """Test streaming selection of a Spot Advisor subtree."""
+    chunks = [SPOT_ADVISOR_DOC[i:i + chunk_size]
+              for i in range(0, len(SPOT_ADVISOR_DOC), chunk_size)]
+    stream = SpotAdvisorStream(chunks)
+    result = stream.select(('spot_advisor', 'us-east-1', 'Linux'), ['t3.medium', 'm6g.large'])
+    assert result == {'t3.medium': {'s': 68, 'r': 0}, 'm6g.large': {'s': 55, 'r': 2}}
+
+def test_spot_advisor_stream_missing_path():
+    """Test streaming selection of an absent region."""
+    stream = SpotAdvisorStream([SPOT_ADVISOR_DOC])
+    assert stream.select(('spot_advisor', 'ap-east-1', 'Linux'), TEST_INSTANCES) == {}
+
+@patch('includes.requests.get')
+def test_spot_savings(mock_get):
+    """Test spot savings retrieval."""
+    mock_response = MagicMock()
+    mock_response.iter_content.return_value = [SPOT_ADVISOR_DOC.encode()]
+    mock_get.return_value = mock_response
+
+    savings = get_ec2_spot_savings(
+        instances=['t3.medium', 't2.medium'],
+        os='Linux',
+        region=region_map[REGION_NVIRGINIA]
+    )
+    assert savings == {'t3.medium': 68, 't2.medium': 65}
+    mock_response.close.assert_called_once()
+
+@patch('includes.requests.get')
+def test_spot_advice(mock_get):
+    """Test that rates and savings come from a single Spot Advisor download."""
+    mock_response = MagicMock()
+    mock_response.iter_content.return_value = [SPOT_ADVISOR_DOC.encode()]
+    mock_get.return_value = mock_response
+
+    rates, savings = get_ec2_spot_advice(
+        instances=['t3.medium', 'm6g.large'],
+        os='Linux',
+        region=region_map[REGION_NVIRGINIA]
+    )
+    assert rates == {'t3.medium': '<5%', 'm6g.large': '10-15%'}
+    assert savings == {'t3.medium': 68, 'm6g.large': 55}
+    mock_get.assert_called_once()
+
+def make_candidates(count, step=0.01):
+    """Build find_ec2-style rows sorted by on-demand price."""
+    return [
+        (index, f'c{index}.large', 2 + index % 3, 4 + index % 5, 'Linux',
+         0.05 + index * step, REGION_NVIRGINIA, date.today())
+        for index in range(count)
+    ]
+
+def expected_top_scores(engine, candidates, spot_prices, buckets, limit):
+    """Score every candidate exhaustively and return the best `limit` scores."""
+    ref_price = min(row[5] for row in candidates)
+    ref_vcpu = min(row[5] / row[2] for row in candidates)
+    ref_gib = min(row[5] / row[3] for row in candidates)
+    weights = engine.weights
+    scores = [
+        weights['price'] * row[5] / ref_price
+        + weights['spot_price'] * (spot_prices.get(row[1]) or row[5]) / ref_price
+        + weights['interruption'] * buckets.get(row[1], 4) / 4
+        + weights['price_per_vcpu'] * row[5] / row[2] / ref_vcpu
+        + weights['price_per_gib'] * row[5] / row[3] / ref_gib
+        for row in candidates
+    ]
+    return sorted(scores)[:limit]
+
+def make_spot_ec2(spot_prices):
+    """Build a mocked EC2 client answering batched spot price history requests."""
+    now = datetime.now(timezone.utc)
+    mock_ec2 = MagicMock()
+    mock_ec2.describe_spot_price_history.side_effect = lambda **kwargs: {
+        'SpotPriceHistory': [
+            {'InstanceType': name, 'SpotPrice': str(spot_prices[name]), 'Timestamp': now}
+            for name in kwargs['InstanceTypes'] if name in spot_prices
+        ]
+    }
+    return mock_ec2
+
+def make_ranking_pricing(spot_prices, buckets):
+    """Build a mocked AWSPricing serving spot prices and Spot Advisor buckets."""
+    pricing = MagicMock()
+    pricing.get_spot_prices.side_effect = lambda names, os, region: {
+        name: spot_prices[name] for name in names if name in spot_prices
+    }
+    pricing.get_spot_advisor.side_effect = lambda names, os, region: {
+        name: {'r': buckets[name], 's': 50} for name in names if name in buckets
+    }
+    return pricing
+
+def test_ranking_finds_spot_deal_past_limit():
+    """Test that a cheap spot instance beyond the on-demand top-k is ranked first."""
+    candidates = make_candidates(50)
+    spot_prices = {row[1]: row[5] * 0.9 for row in candidates}
+    spot_prices['c5.large'] = 0.005
+    pricing = make_ranking_pricing(spot_prices, {row[1]: 0 for row in candidates})
+
+    ranked = RankingEngine(pricing).rank(candidates, 'Linux', REGION_NVIRGINIA, 3)
+    assert ranked[0][0][1] == 'c5.large'
+    assert ranked[0][1] == 0.005
+    assert ranked[0][2] == '<5%'
+    assert ranked[0][3] == 50
+    assert len(ranked) == 3
+    assert pricing.get_spot_prices.call_count == 1
+    pricing.get_spot_advisor.assert_called_once()
+
+@pytest.mark.parametrize("weights", [
+    {'price': 1.0, 'spot_price': 0.0, 'interruption': 0.0},
+    {'spot_price': 1.0, 'interruption': 0.5},
+    {'price': 0.2, 'spot_price': 1.0, 'interruption': 1.0,
+     'price_per_vcpu': 0.5, 'price_per_gib': 0.5},
+])
+def test_ranking_matches_full_scoring(weights):
+    """Test that lazy ranking returns the exhaustive top-k with fewer spot lookups."""
+    candidates = make_candidates(60)
+    spot_prices = {row[1]: row[5] * (0.2 + (index * 7 % 11) / 10)
+                   for index, row in enumerate(candidates) if index % 9}
+    buckets = {row[1]: index % 5 for index, row in enumerate(candidates) if index % 4}
+    pricing = make_ranking_pricing(spot_prices, buckets)
+    engine = RankingEngine(pricing, weights)
+
+    ranked = engine.rank(candidates, 'Linux', REGION_NVIRGINIA, 5)
+
+    expected = expected_top_scores(engine, candidates, spot_prices, buckets, 5)
+    assert [score for *_, score in ranked] == pytest.approx(expected)
+    assert pricing.get_spot_prices.call_count <= math.ceil(len(candidates) / SPOT_PRICE_BATCH_SIZE)
+
+@pytest.mark.parametrize("weights", [
+    None,
+    {'price': 0.0, 'interruption': 0.0, 'spot_price': 1.0},
+])
+def test_ranking_bounds_spot_api_calls(aws_pricing, weights):
+    """Test that ranking returns the exact top-k with one spot price call per batch at most."""
+    candidates = make_candidates(100)
+    spot_prices = {row[1]: row[5] * (0.3 + (index * 7 % 5) / 10)
+                   for index, row in enumerate(candidates)}
+    buckets = {row[1]: 1 for row in candidates}
+    advice = {name: {'r': bucket, 's': 50} for name, bucket in buckets.items()}
+    mock_ec2 = make_spot_ec2(spot_prices)
+
+    with patch.object(aws_pricing, 'get_boto_clients', return_value=(MagicMock(), mock_ec2)), \
+            patch.object(aws_pricing, 'get_spot_advisor', return_value=advice):
+        engine = RankingEngine(aws_pricing, weights)
+        ranked = engine.rank(candidates, 'Linux', REGION_NVIRGINIA, 10)
+
+    expected = expected_top_scores(engine, candidates, spot_prices, buckets, 10)
+    assert [score for *_, score in ranked] == pytest.approx(expected)
+    assert all(spot_price == spot_prices[row[1]] for row, spot_price, *_ in ranked)
+    assert mock_ec2.describe_spot_price_history.call_count <= math.ceil(
+        len(candidates) / SPOT_PRICE_BATCH_SIZE)
+
+def test_ranking_finds_deep_spot_deal(aws_pricing):
+    """Test that a spot deal near the end of the candidate list is still found."""
+    candidates = make_candidates(100, step=0.0005)
+    spot_prices = {row[1]: row[5] * 0.6 for row in candidates}
+    spot_prices['c95.large'] = 0.001
+    buckets = {row[1]: 0 for row in candidates}
+    advice = {name: {'r': bucket, 's': 40} for name, bucket in buckets.items()}
+    mock_ec2 = make_spot_ec2(spot_prices)
+
+    with patch.object(aws_pricing, 'get_boto_clients', return_value=(MagicMock(), mock_ec2)), \
+            patch.object(aws_pricing, 'get_spot_advisor', return_value=advice):
+        engine = RankingEngine(aws_pricing)
+        ranked = engine.rank(candidates, 'Linux', REGION_NVIRGINIA, 5)
+
+    assert ranked[0][0][1] == 'c95.large'
+    assert ranked[0][1] == 0.001
+    expected = expected_top_scores(engine, candidates, spot_prices, buckets, 5)
+    assert [score for *_, score in ranked] == pytest.approx(expected)
+    assert mock_ec2.describe_spot_price_history.call_count <= math.ceil(
+        len(candidates) / SPOT_PRICE_BATCH_SIZE)
+
+def test_ranking_coerces_savings():
+    """Test that ranked results report savings like get_spot_advice does."""
+    candidates = make_candidates(3)
+    pricing = make_ranking_pricing({}, {})
+    pricing.get_spot_advisor.side_effect = None
+    pricing.get_spot_advisor.return_value = {
+        'c0.large': {'r': 0, 's': 'n/a'},
+        'c1.large': {'r': 9, 's': 55.0},
+        'c2.large': {'s': None}
+    }
+
+    ranked = RankingEngine(pricing).rank(candidates, 'Linux', REGION_NVIRGINIA, 3)
+    details = {row[1]: (kill_rate, savings) for row, _, kill_rate, savings, _ in ranked}
+    assert details == {'c0.large': ('<5%', 0), 'c1.large': ('', 55), 'c2.large': ('', 0)}
+    assert all(isinstance(savings, int) for _, savings in details.values())
+
+def test_ranking_rejects_unknown_criteria():
+    """Test ranking weight validation."""
+    with pytest.raises(ValueError):
+        RankingEngine(MagicMock(), {'latency': 1.0})
+
 @patch('includes.boto3.Session')
 def test_spot_prices(mock_session):
     """Test spot prices retrieval."""
+    now = datetime.now(timezone.utc)
     mock_ec2 = MagicMock()
-    mock_ec2.describe_spot_price_history.return_value = {
-        'SpotPriceHistory': [{'SpotPrice': '0.0416'}]
-    }
+    mock_ec2.describe_spot_price_history.side_effect = [
+        {
+            'SpotPriceHistory': [
+                {'InstanceType': 't3.medium', 'SpotPrice': '0.0400',
+                 'Timestamp': now - timedelta(hours=1)}
+            ],
+            'NextToken': 'page2'
+        },
+        {
+            'SpotPriceHistory': [
+                {'InstanceType': 't3.medium', 'SpotPrice': '0.0416', 'Timestamp': now},
+                {'InstanceType': 't3.large', 'SpotPrice': '0.0832', 'Timestamp': now}
+            ],
+            'NextToken': ''
+        }
+    ]
     mock_session.return_value.client.return_value = mock_ec2
 
     prices = get_ec2_spot_price(
-        instances=['t3.medium'],
+        instances=['t3.medium', 't3.large', 'm6g.large'],
         os=P_OS,
         region=REGION_NVIRGINIA
     )
-    assert len(prices) == 1
-    assert prices['t3.medium'] == 0.0416
+    assert prices == {'t3.medium': 0.0416, 't3.large': 0.0832}
+    assert mock_ec2.describe_spot_price_history.call_count == 2
+    assert mock_ec2.describe_spot_price_history.call_args.kwargs['NextToken'] == 'page2'
 
 def test_get_sys_argv_positive():
     """Test command line argument parsing - positive cases."""
-    success, text_only, pvcpu, pram, pos, pregion = get_sys_argv(
+    success, text_only, ranked, pvcpu, pram, pos, pregion = get_sys_argv(
         ['', '-t', '8', '16', 'Linux', REGION_NVIRGINIA]
     )
     assert success
     assert text_only is True
+    assert ranked is False
     assert pvcpu == 8
     assert pram == 16
     assert pos == 'Linux'
     assert pregion == REGION_NVIRGINIA
 
+def test_get_sys_argv_ranked():
+    """Test command line argument parsing for spot-aware ranking."""
+    success, text_only, ranked, *_ = get_sys_argv(['', '-s', '8', '16'])
+    assert success
+    assert text_only is True
+    assert ranked is True
+
 def test_get_sys_argv_help():
     """Test help command line argument."""
     success, *_ = get_sys_argv(['', '-h'])
@@ -158,13 +487,26 @@ def test_get_sys_argv_negative(args, expected):
 
 @patch('awsEC2pricing.find_ec2')
 @patch('awsEC2pricing.get_ec2_spot_price')
-@patch('awsEC2pricing.get_ec2_spot_interruption')
-def test_main(mock_interrupt, mock_spot, mock_find):
+@patch('awsEC2pricing.get_ec2_spot_advice')
+def test_main(mock_advice, mock_spot, mock_find):
     """Test main function execution."""
     mock_find.return_value = [
         (1, 't3.medium', 2, 4, 'Linux', 0.0416, REGION_NVIRGINIA, date.today())
     ]
     mock_spot.return_value = {'t3.medium': 0.0416}
-    mock_interrupt.return_value = {'t3.medium': '<5%'}
+    mock_advice.return_value = ({'t3.medium': '<5%'}, {'t3.medium': 68})
+
+    assert main(testing=True) is True
+
+@patch('awsEC2pricing.get_sanitized_args')
+@patch('awsEC2pricing.rank_ec2')
+def test_main_ranked(mock_rank, mock_args):
+    """Test main function execution with spot-aware ranking."""
+    mock_args.return_value = ['', '-s', '8', '16', 'Linux', REGION_NVIRGINIA]
+    mock_rank.return_value = [
+        ((1, 't3.medium', 2, 4, 'Linux', 0.0416, REGION_NVIRGINIA, date.today()),
+         0.0125, '<5%', 68, 0.3)
+    ]
 
     assert main(testing=True) is True
+    mock_rank.assert_called_once()